@@ -1,4 +1,4 @@
-version = "1.5.0"
+version = "1.5.1"
 
 # changelog
 # 1.1.0 - llama3 using groq
@@ -6,12 +6,15 @@ version = "1.5.0"
 # 1.3.0 - openrouter substring matches
 # 1.4.0 - gpt4o-mini support and becomes the default
 # 1.5.0 - openrouter buttons
+# 1.5.1 - full backend responses and outgoing messages are only printed when DEBUG=1 (or true/yes) is set,
+#         an error reply is sent when an AI backend times out or fails, the openrouter model list is cached for an hour,
+#         openrouter model buttons work for chats that have no session yet (e.g. after a restart)
 
 import requests
 import base64
 import os
 import json
-from datetime import datetime
+import time
 
 # Get the API keys from the environment variables
 API_KEY = os.environ.get('API_KEY')
@@ -20,12 +23,36 @@ ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
 OPENROUTER_API_KEY = os.environ.get('OPENROUTER_API_KEY')
 GROQ_API_KEY = os.environ.get('GROQ_API_KEY')
 
+# set DEBUG=1 (or true/yes) to print full backend responses and outgoing messages, these are large and contain
+# user conversations so they are off by default, any other value such as DEBUG=0 or DEBUG=false leaves them off
+DEBUG = os.environ.get('DEBUG', '').lower() in ('1', 'true', 'yes')
+
 # Set the URL for the API
 OPENAI_API_URL = 'https://api.openai.com/v1/chat/completions'
 ANTHROPIC_API_URL = 'https://api.anthropic.com/v1/messages'
 OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 GROQ_API_URL = 'https://api.groq.com/openai/v1/chat/completions'
 
+# The request headers never change while the bot runs, so build them once here
+OPENAI_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {API_KEY}",
+}
+OPENROUTER_HEADERS = {
+    "Content-Type": "application/json",
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+}
+ANTHROPIC_HEADERS = {
+    "x-api-key": ANTHROPIC_API_KEY,
+    "anthropic-version": "2023-06-01",
+    "content-type": "application/json",
+}
+# Groq is optional, without a key the llama3 models report the missing key instead of sending "Bearer None"
+GROQ_HEADERS = {
+    "Authorization": "Bearer " + GROQ_API_KEY,
+    "content-type": "application/json",
+} if GROQ_API_KEY else None
+
 # list of the possible "model" values:
 # gpt-3.5-turbo
 # gpt-4-turbo
@@ -43,31 +70,76 @@ session_data = {}
 # default conversation max rounds is 4 which is double the previous version of the bot
 DEFAULT_MAX_ROUNDS = 4
 
+# the openrouter model list changes rarely, so keep a copy for an hour instead of fetching it on every command
+OPENROUTER_MODELS_TTL = 3600
+openrouter_models_cache = {"timestamp": None, "data": None}
+
+# network timeouts in seconds so a stalled connection can't hang the polling loop forever
+# the AI backends can take a long time on big answers, telegram long polling waits up to TELEGRAM_POLL_TIMEOUT itself
+AI_REQUEST_TIMEOUT = 180
+HTTP_TIMEOUT = 30
+TELEGRAM_POLL_TIMEOUT = 100
+
+# one shared session so repeated calls to telegram and the AI backends reuse their open connections
+# instead of doing a fresh TCP and TLS handshake for every request
+http_session = requests.Session()
+
+# telegram rejects messages longer than this so longer replies are split
+MAX_MESSAGE_LENGTH = 4096
+
+
+# text for the /help command, it never changes so build it once
+HELP_TEXT = (
+    "Commands:\n"
+    "/help - this help message\n"
+    "/clear - clear the context\n"
+    "/maxrounds <n> - set the max rounds of conversation\n"
+    "/gpt3 - set the model to gpt3\n"
+    "/gpt4 - set the model to gpt-4-turbo\n"
+    "/gpt4o - set the model to gpt-4o\n"
+    "/gpt4omini - set the model to gpt-4o-mini\n"
+    "/claud3opus - set the model to Claud 3 Opus\n"
+    "/claud3haiku - set the model to Claud 3 Haiku\n"
+    "/llama38b - set the model to Llama 3 8B\n"
+    "/llama370b - set the model to Llama 3 70B\n"
+    "/listopenroutermodels - list all openrouter models\n"
+    "/openrouter <model id> - set the model to the model with the given id\n"
+    "/status - get the chatbot status, current model, current max rounds, current conversation length"
+)
+
+# model switching commands and the model each one selects, looked up in one step instead of an if/elif chain
+MODEL_COMMANDS = {
+    "/gpt3": "gpt-3.5-turbo",
+    "/gpt4": "gpt-4-turbo",
+    "/gpt4o": "gpt-4o",
+    "/gpt4omini": "gpt-4o-mini",
+    "/claud3opus": "claude-3-opus-20240229",
+    "/claud3haiku": "claude-3-haiku-20240307",
+    "/llama38b": "llama3-8b-8192",
+    "/llama370b": "llama3-70b-8192",
+}
+
+# message prefixes that are routed to update_model_version, as a tuple so one startswith call checks them all
+MODEL_COMMAND_PREFIXES = ("/gpt3", "/gpt4", "/claud3", "/llama3")
+
 
 def update_model_version(session_id, command):
-    if command.lower() == "/gpt3":
-        session_data[session_id]["model_version"] = "gpt-3.5-turbo"
-    elif command.lower() == "/gpt4":
-        session_data[session_id]["model_version"] = "gpt-4-turbo"
-    elif command.lower() == "/gpt4o":
-        session_data[session_id]["model_version"] = "gpt-4o"
-    elif command.lower() == "/gpt4omini":  # Add this line
-        session_data[session_id]["model_version"] = "gpt-4o-mini"  # Add this line
-    elif command.lower() == "/claud3opus":
-        session_data[session_id]["model_version"] = "claude-3-opus-20240229"
-    elif command.lower() == "/claud3haiku":
-        session_data[session_id]["model_version"] = "claude-3-haiku-20240307"
-    elif command.lower().startswith('/openrouter') and len(command.split()) == 2: # Handle single match here
-        model_substring = command.split()[1]
-        matching_models = get_matching_models(model_substring)
-        if len(matching_models) == 1:
-            session_data[session_id]["model_version"] = "openrouter:" + matching_models[0]
-            session_data[session_id]["provider"] = "openrouter"
-    elif command.lower() == "/llama38b":
-        session_data[session_id]["model_version"] = "llama3-8b-8192"
-    elif command.lower() == "/llama370b":
-        session_data[session_id]["model_version"] = "llama3-70b-8192"
-    print(f"Debug: Session data after model update: {session_data[session_id]}")
+    command_lower = command.lower()
+    # /openrouter is handled in long_polling since it can need a button reply
+    if command_lower in MODEL_COMMANDS:
+        session_data[session_id]["model_version"] = MODEL_COMMANDS[command_lower]
+    if DEBUG:
+        print(f"Debug: Session data after model update: {session_data[session_id]}")
+
+
+# create a fresh session for a chat, every key is set in the one dict literal
+def initialize_session(chat_id):
+    session_data[chat_id] = {
+        "model_version": "gpt-4o-mini",
+        "CONVERSATION": [],
+        "tokens_used": 0,
+        "max_rounds": DEFAULT_MAX_ROUNDS,
+    }
 
 
 def clear_context(chat_id):
@@ -77,18 +149,15 @@ def clear_context(chat_id):
 def get_reply(message, image_data_64, session_id):
     note = ""
     response_text = ""
-    if not session_data[session_id]:
-        session_data[session_id] = {
-            "CONVERSATION": [],
-            "tokens_used": 0,
-            "model_version": "gpt-4o-mini",
-            "max_rounds": DEFAULT_MAX_ROUNDS
-        }
+    if not session_data.get(session_id):
+        initialize_session(session_id)
+    # look the session up once, it is used all through building the request and handling the reply
+    session = session_data[session_id]
     has_image = False
     # check the length of the existing conversation, if it is too long (with messages more than double the max rounds, then trim off until it is within the limit of rounds. one round is one user and one assistant text.
-    max_messages = session_data[session_id]["max_rounds"] * 2
-    if len(session_data[session_id]["CONVERSATION"]) > max_messages:
-        session_data[session_id]["CONVERSATION"] = session_data[session_id]["CONVERSATION"][-max_messages:]
+    max_messages = session["max_rounds"] * 2
+    if len(session["CONVERSATION"]) > max_messages:
+        session["CONVERSATION"] = session["CONVERSATION"][-max_messages:]
 
     # Add the new user message to the conversation
     new_user_message = [
@@ -106,174 +175,185 @@ def get_reply(message, image_data_64, session_id):
         }
         new_user_message[0]["content"].append(image_content_item)
     # Update the conversation with the new user message
-    session_data[session_id]["CONVERSATION"].extend(new_user_message)
+    session["CONVERSATION"].extend(new_user_message)
+
+    model = session["model_version"]
 
-    # Construct the payload with the entire conversation so far
-    if not has_image:
-        for message in session_data[session_id]["CONVERSATION"]:
-            for content_obj in message.get("content", []):
-                if content_obj.get("type") == "image_url":
-                    has_image = True
-                    break
+    # Only the llama3 branch needs to know if the conversation holds an image, so skip the scan for other models
+    # and stop at the first image found
+    if not has_image and model.startswith("llama3"):
+        has_image = any(
+            content_obj.get("type") == "image_url"
+            for message in session["CONVERSATION"]
+            for content_obj in message.get("content", [])
+        )
 
     # print (f"has_image: {has_image}")
 
-    model = session_data[session_id]["model_version"]
 
 
+    # a backend that times out or drops the connection must still get the user a reply, and the user turn added
+    # above is taken back out so the conversation does not end up with two user messages in a row
+    try:
+        if model.startswith("gpt"):
+            payload = {
+                "model": model,
+                "max_tokens": 4000,
+                "messages": session["CONVERSATION"],
+            }
 
-    if model.startswith("gpt"):
-        payload = {
-            "model": model,
-            "max_tokens": 4000,
-            "messages": session_data[session_id]["CONVERSATION"],
-        }
+            raw_response = http_session.post(
+                OPENAI_API_URL,
+                headers=OPENAI_HEADERS,
+                json=payload,
+                timeout=AI_REQUEST_TIMEOUT,
+            )
+        elif model.startswith("openrouter"):
+            # if an openrouter model then strip of the string "openrouter:" from the beginning
+            # model = model[11:]
+            payload = {
+                "model": model[11:],
+                "max_tokens": 4000,
+                "messages": session["CONVERSATION"],
+            }
+
+            raw_response = http_session.post(
+                OPENROUTER_API_URL,
+                headers=OPENROUTER_HEADERS,
+                json=payload,
+                timeout=AI_REQUEST_TIMEOUT,
+            )
 
-        raw_response = requests.post(
-            OPENAI_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {API_KEY}",
-            },
-            json=payload,
-        )
-    elif model.startswith("openrouter"):
-        # if an openrouter model then strip of the string "openrouter:" from the beginning
-        # model = model[11:]
-        payload = {
-            "model": model[11:],
-            "max_tokens": 4000,
-            "messages": session_data[session_id]["CONVERSATION"],
-        }
+        elif model.startswith("claud"):
+            anthropic_payload = {
+                "model": model,
+                "max_tokens": 3000,
+                "messages": [],
+            }
+
+            for message in session["CONVERSATION"]:
+                anthropic_message = {"role": message["role"], "content": []}
+
+                for content in message["content"]:
+                    if content["type"] == "text":
+                        anthropic_message["content"].append({"type": "text", "text": content["text"]})
+                    elif content["type"] == "image_url":
+                        image_url = content["image_url"]["url"]
+                        if image_url.startswith("data:image/jpeg;base64,"):
+                            image_data_64 = image_url[len("data:image/jpeg;base64,"):]
+                        else:
+                            # If the image URL is not base64-encoded, you'll need to fetch and encode it
+                            image_response = http_session.get(image_url, timeout=HTTP_TIMEOUT)
+                            image_data_64 = base64.b64encode(image_response.content).decode("utf-8")
+
+                        anthropic_message["content"].append({
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": "image/jpeg",
+                                "data": image_data_64
+                            }
+                        })
+
+                anthropic_payload["messages"].append(anthropic_message)
+
+            raw_response = http_session.post(
+                ANTHROPIC_API_URL,
+                headers=ANTHROPIC_HEADERS,
+                json=anthropic_payload,
+                timeout=AI_REQUEST_TIMEOUT,
+            )
 
-        raw_response = requests.post(
-            OPENROUTER_API_URL,
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-            },
-            json=payload,
-        )
+        elif model.startswith("llama3"):
+            if GROQ_HEADERS is None:
+                print("Error calling AI backend: GROQ_API_KEY is not set")
+                session["CONVERSATION"].pop()
+                return "Error message: GROQ_API_KEY is not set, the llama3 models are not available", 0
 
-    elif model.startswith("claud"):
-        anthropic_payload = {
-            "model": model,
-            "max_tokens": 3000,
-            "messages": [],
-        }
+            if has_image:
+                session["model_version"] = model
+                note = " (image included)"
+            else:
+                note = ""
+
+            groq_payload = {
+                "model": model,
+                "max_tokens": 8000,
+                "messages": [],
+            }
+            groq_messages = []
+            for message in session["CONVERSATION"]:
+                groq_message = {}
+                groq_message["role"] = message["role"]
+                groq_message["content"] = ""
+                for content in message["content"]:
+                    if content["type"] == "text":
+                        groq_message["content"] = content["text"]
+                        break
+                groq_messages.append(groq_message)
 
-        for message in session_data[session_id]["CONVERSATION"]:
-            anthropic_message = {"role": message["role"], "content": []}
+            groq_payload["messages"] = groq_messages
 
-            for content in message["content"]:
-                if content["type"] == "text":
-                    anthropic_message["content"].append({"type": "text", "text": content["text"]})
-                elif content["type"] == "image_url":
-                    image_url = content["image_url"]["url"]
-                    if image_url.startswith("data:image/jpeg;base64,"):
-                        image_data_64 = image_url[len("data:image/jpeg;base64,"):]
-                    else:
-                        # If the image URL is not base64-encoded, you'll need to fetch and encode it
-                        image_response = requests.get(image_url)
-                        image_data_64 = base64.b64encode(image_response.content).decode("utf-8")
-
-                    anthropic_message["content"].append({
-                        "type": "image",
-                        "source": {
-                            "type": "base64",
-                            "media_type": "image/jpeg",
-                            "data": image_data_64
-                        }
-                    })
-
-            anthropic_payload["messages"].append(anthropic_message)
-
-        raw_response = requests.post(
-            ANTHROPIC_API_URL,
-            headers={
-                "x-api-key": ANTHROPIC_API_KEY,
-                "anthropic-version": "2023-06-01",
-                "content-type": "application/json",
-            },
-            json=anthropic_payload,
-        )
+            raw_response = http_session.post(
+                GROQ_API_URL,
+                headers=GROQ_HEADERS,
+                json=groq_payload,
+                timeout=AI_REQUEST_TIMEOUT,
+            )
 
-    elif model.startswith("llama3"):
-        if has_image:
-            session_data[session_id]["model_version"] = model
-            note = " (image included)"
-        else:
-            note = ""
-            
-        groq_payload = {
-            "model": model,
-            "max_tokens": 8000,
-            "messages": [],
-        }
-        groq_messages = []
-        for message in session_data[session_id]["CONVERSATION"]:
-            groq_message = {}
-            groq_message["role"] = message["role"]
-            groq_message["content"] = ""
-            for content in message["content"]:
-                if content["type"] == "text":
-                    groq_message["content"] = content["text"]
-                    break
-            groq_messages.append(groq_message)
-            
-        groq_payload["messages"] = groq_messages
-        
-        raw_response = requests.post(
-            GROQ_API_URL,
-            headers={
-                "Authorization": "Bearer " + GROQ_API_KEY,                
-                "content-type": "application/json",
-            },
-            json=groq_payload
-        )
+        # decode here so a non-JSON body (e.g. a 502/504 page from a gateway) is handled like a failed request,
+        # older requests versions raise a plain ValueError for that instead of a RequestException
+        raw_json = raw_response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error calling AI backend: {e}")
+        session["CONVERSATION"].pop()
+        return f"Error message: the AI backend did not give a usable response ({type(e).__name__}), please try again" + note, 0
 
     # Handle the response
-    raw_json = raw_response.json()
     
-    print("Raw JSON response from AI backend:")
-    print(json.dumps(raw_json, indent=4 ))
+    if DEBUG:
+        print("Raw JSON response from AI backend:")
+        print(json.dumps(raw_json, indent=4 ))
 
     if "error" in raw_json:
         print("Error detected in AI backend response.")
         return f"Error message: {raw_json['error']['message']}" + note, 0
 
     # Update tokens used and process the response based on the model used
-    tokens_used = session_data[session_id]["tokens_used"]
-    if model.startswith("gpt") or model.startswith("openrouter"):
+    tokens_used = session["tokens_used"]
+    if model.startswith(("gpt", "openrouter")):
         tokens_used += raw_json["usage"]["total_tokens"]
         response_text = (
             raw_json["choices"][0]["message"]["content"].strip()
             if raw_json["choices"]
             else "API error occurred." + note
         )
-        print(f"Response text for gpt or openrouter model: {response_text}")
+        if DEBUG:
+            print(f"Response text for gpt or openrouter model: {response_text}")
     elif model.startswith("claud"):
         tokens_used += (
             raw_json["usage"]["prompt_tokens"] + raw_json["usage"]["completion_tokens"]
         )
-        print("Debug: 'choices' field in raw_json:")
-        print(raw_json.get("choices"))
-        if raw_json.get("choices"):
-            print("Debug: First item in 'choices':")
-            print(raw_json["choices"][0])
-            if raw_json["choices"][0].get("message"):
-                print("Debug: 'message' field in first item of 'choices':")
-                print(raw_json["choices"][0]["message"])
-                if raw_json["choices"][0]["message"].get("content"):
-                    print("Debug: 'content' field in 'message':")
-                    print(raw_json["choices"][0]["message"]["content"])
+        if DEBUG:
+            print("Debug: 'choices' field in raw_json:")
+            print(raw_json.get("choices"))
+            if raw_json.get("choices"):
+                print("Debug: First item in 'choices':")
+                print(raw_json["choices"][0])
+                if raw_json["choices"][0].get("message"):
+                    print("Debug: 'message' field in first item of 'choices':")
+                    print(raw_json["choices"][0]["message"])
+                    if raw_json["choices"][0]["message"].get("content"):
+                        print("Debug: 'content' field in 'message':")
+                        print(raw_json["choices"][0]["message"]["content"])
         if "choices" in raw_json and "message" in raw_json["choices"][0] and "content" in raw_json["choices"][0]["message"]:
             response_text = (
                 raw_json["choices"][0]["message"]["content"].strip() + note
             )
         else:
             response_text = "API error occurred." + note
-        print(f"Response text for claud model: {response_text}")
+        if DEBUG:
+            print(f"Response text for claud model: {response_text}")
     elif model.startswith("llama3"):
         tokens_used += raw_json["usage"]["total_tokens"]
         response_text = (
@@ -281,7 +361,8 @@ def get_reply(message, image_data_64, session_id):
             if raw_json["choices"]
             else "API error occurred." + note
         )
-        print(f"Response text for llama3 model: {response_text}")
+        if DEBUG:
+            print(f"Response text for llama3 model: {response_text}")
 
     # Update the conversation with the assistant response
     assistant_response = [
@@ -291,11 +372,11 @@ def get_reply(message, image_data_64, session_id):
             # "datetime": datetime.now(),
         }
     ]
-    session_data[session_id]["CONVERSATION"].extend(assistant_response)
-    session_data[session_id]["tokens_used"] = tokens_used
+    session["CONVERSATION"].extend(assistant_response)
+    session["tokens_used"] = tokens_used
 
     # Optional: print the session_data for debugging
-    # print(json.dumps(session_data[session_id], indent=4))
+    # print(json.dumps(session, indent=4))
 
     return response_text, tokens_used
 
@@ -303,14 +384,23 @@ def get_reply(message, image_data_64, session_id):
 # Function to download the image given the file path
 def download_image(file_path):
     file_url = f"https://api.telegram.org/file/bot{BOT_KEY}/{file_path}"
-    response = requests.get(file_url)
+    response = http_session.get(file_url, timeout=HTTP_TIMEOUT)
     return response.content
 
 
-# get list from https://openrouter.ai/api/v1/models
+# get list from https://openrouter.ai/api/v1/models, cached for OPENROUTER_MODELS_TTL seconds
+def get_openrouter_models():
+    # monotonic so a wall clock change can't keep a stale list or drop a fresh one
+    now = time.monotonic()
+    if openrouter_models_cache["timestamp"] is None or now - openrouter_models_cache["timestamp"] > OPENROUTER_MODELS_TTL:
+        response = http_session.get("https://openrouter.ai/api/v1/models", timeout=HTTP_TIMEOUT)
+        openrouter_models_cache["data"] = response.json()['data']
+        openrouter_models_cache["timestamp"] = now
+    return openrouter_models_cache["data"]
+
+
 def list_openrouter_models_as_message():
-    response = requests.get(f"https://openrouter.ai/api/v1/models")
-    openRouterModelList = response.json()['data']
+    openRouterModelList = get_openrouter_models()
     model_list = "Model ID : Model Name\n\n"
     for model in openRouterModelList:  # include only id and name fields
         model_list += f"{model['id']} : {model['name']}\n"
@@ -318,14 +408,8 @@ def list_openrouter_models_as_message():
     return model_list
 
 
-# get list from https://openrouter.ai/api/v1/models
 def list_openrouter_models_as_list():
-    response = requests.get(f"https://openrouter.ai/api/v1/models")
-    openRouterModelList = response.json()['data']
-    model_list = []
-    for model in openRouterModelList:
-        model_list.append(model['id'])
-    return model_list
+    return [model['id'] for model in get_openrouter_models()]
 
 def get_matching_models(substring):
     all_models = list_openrouter_models_as_list()
@@ -339,13 +423,17 @@ def long_polling():
     while True:
         try:
             # Long polling request to get new messages
-            response = requests.get(f"https://api.telegram.org/bot{BOT_KEY}/getUpdates?timeout=100&offset={offset}")
+            response = http_session.get(f"https://api.telegram.org/bot{BOT_KEY}/getUpdates?timeout={TELEGRAM_POLL_TIMEOUT}&offset={offset}",
+                                    timeout=TELEGRAM_POLL_TIMEOUT + HTTP_TIMEOUT)
 
             # presume the response is json and pretty print it with nice colors and formatting
             # print(response.json(), indent=4, sort_dicts=False)
 
+            # Decode the body once, it is needed again below
+            updates = response.json()['result']
+
             # If there is no response then continue the loop
-            if not response.json()['result']:
+            if not updates:
                 continue
 
 
@@ -356,7 +444,7 @@ def long_polling():
         try:
 
             # Get the latest message and update the offset
-            latest_message = response.json()['result'][-1]
+            latest_message = updates[-1]
             offset = latest_message['update_id'] + 1
 
             # Check if we have a message or callback query
@@ -368,18 +456,23 @@ def long_polling():
                 callback_query = latest_message['callback_query']
                 chat_id = callback_query['message']['chat']['id']
                 selected_model = callback_query['data']
-                
+
+                # the button may have been pressed after a restart, so the session may not exist yet
+                if chat_id not in session_data:
+                    initialize_session(chat_id)
+
                 # Update the model version
-                session_data[chat_id]["model_version"] = "openrouter:" + selected_model
-                session_data[chat_id]["provider"] = "openrouter"
+                session = session_data[chat_id]
+                session["model_version"] = "openrouter:" + selected_model
+                session["provider"] = "openrouter"
                 
                 # Send confirmation message
                 send_message(chat_id, f"Model has been changed to {selected_model}")
                 
                 # Acknowledge the callback query
-                requests.post(f"https://api.telegram.org/bot{BOT_KEY}/answerCallbackQuery", json={
+                http_session.post(f"https://api.telegram.org/bot{BOT_KEY}/answerCallbackQuery", json={
                     "callback_query_id": callback_query['id']
-                })
+                }, timeout=HTTP_TIMEOUT)
                 continue
             else:
                 continue
@@ -389,11 +482,12 @@ def long_polling():
             if len(message_text) > 3000:
                 # fast loop to look for any additional messages, down side of this is it adds at least one second
                 while True:
-                    additional_response = requests.get(f"https://api.telegram.org/bot{BOT_KEY}/getUpdates?timeout=1&offset={offset}")
-                    if not additional_response.json()['result']:
+                    additional_response = http_session.get(f"https://api.telegram.org/bot{BOT_KEY}/getUpdates?timeout=1&offset={offset}", timeout=HTTP_TIMEOUT)
+                    additional_updates = additional_response.json()['result']
+                    if not additional_updates:
                         break
                     else:
-                        additional_latest_message = additional_response.json()['result'][-1]
+                        additional_latest_message = additional_updates[-1]
                         message_text += additional_latest_message['message']['text']
                         offset = additional_latest_message['update_id'] + 1
                         # after having got this additional text we loop because there might be more
@@ -401,11 +495,8 @@ def long_polling():
 
             # check in the session data if there is a key with this chat_id, if not then initialize an empty one
             if chat_id not in session_data:  # doing it now because we may have to accept setting model version
-                session_data[chat_id] = {'model_version': "gpt-4o-mini",
-                                        'CONVERSATION': [],
-                                        'tokens_used': 0,
-                                        "max_rounds": DEFAULT_MAX_ROUNDS
-                                        }
+                initialize_session(chat_id)
+            session = session_data[chat_id]
 
         except Exception as e:
             print(f"Error reading last message on line {e.__traceback__.tb_lineno}: {e}")
@@ -415,51 +506,36 @@ def long_polling():
 
             # implement a /help command that outputs brief explanation of commands
             if message_text.startswith('/help'):
-                reply_text = "Commands:\n"
-                reply_text += "/help - this help message\n"
-                reply_text += "/clear - clear the context\n"
-                reply_text += "/maxrounds <n> - set the max rounds of conversation\n"
-                reply_text += "/gpt3 - set the model to gpt3\n"
-                reply_text += "/gpt4 - set the model to gpt-4-turbo\n"
-                reply_text += "/gpt4o - set the model to gpt-4o\n"
-                reply_text += "/gpt4omini - set the model to gpt-4o-mini\n"  # Add this line
-                reply_text += "/claud3opus - set the model to Claud 3 Opus\n"
-                reply_text += "/claud3haiku - set the model to Claud 3 Haiku\n"
-                reply_text += "/llama38b - set the model to Llama 3 8B\n"
-                reply_text += "/llama370b - set the model to Llama 3 70B\n"
-                reply_text += "/listopenroutermodels - list all openrouter models\n"
-                reply_text += "/openrouter <model id> - set the model to the model with the given id\n"
-                reply_text += "/status - get the chatbot status, current model, current max rounds, current conversation length"
-
-                send_message(chat_id, reply_text)
+                send_message(chat_id, HELP_TEXT)
                 continue  # Skip the rest of the processing loop
 
             if message_text.startswith('/status'):
-                reply_text = f"Model: {session_data[chat_id]['model_version']}\n"
-                reply_text += f"Provider: {session_data[chat_id].get('provider', 'Not set')}\n"
-                reply_text += f"Max rounds: {session_data[chat_id]['max_rounds']}\n"
-                reply_text += f"Conversation length: {len(session_data[chat_id]['CONVERSATION'])}\n"
+                reply_text = f"Model: {session['model_version']}\n"
+                reply_text += f"Provider: {session.get('provider', 'Not set')}\n"
+                reply_text += f"Max rounds: {session['max_rounds']}\n"
+                reply_text += f"Conversation length: {len(session['CONVERSATION'])}\n"
                 reply_text += f"Chatbot version: {version}\n"
                 send_message(chat_id, reply_text)
                 continue
 
             if message_text.startswith('/maxrounds'):
-                if len(message_text.split()) == 1:
-                    reply_text = f"Max rounds is currently set to {session_data[chat_id]['max_rounds']}" 
+                command_args = message_text.split()
+                if len(command_args) == 1:
+                    reply_text = f"Max rounds is currently set to {session['max_rounds']}" 
                     send_message(chat_id, reply_text)
                     continue
 
                 max_rounds = DEFAULT_MAX_ROUNDS
                 try:
-                    if len(message_text.split()) > 1:
-                        max_rounds = int(message_text.split()[1])
+                    if len(command_args) > 1:
+                        max_rounds = int(command_args[1])
                 except ValueError:
                     max_rounds = DEFAULT_MAX_ROUNDS
                 
                 if max_rounds < 1:
                     max_rounds = DEFAULT_MAX_ROUNDS
                 
-                session_data[chat_id]['max_rounds'] = max_rounds
+                session['max_rounds'] = max_rounds
                 reply_text = f"Max rounds set to {max_rounds}"
                 send_message(chat_id, reply_text)
                 continue  
@@ -471,7 +547,8 @@ def long_polling():
                 send_message(chat_id, reply_text)
                 continue  # Skip the rest of the processing loop
 
-            # Handle listopenroutermodels command, query live list from https://openrouter.ai/api/v1/models and respond in a text format message
+            # Handle listopenroutermodels command, the list comes from the get_openrouter_models cache so it can be up to
+            # OPENROUTER_MODELS_TTL old, and respond in a text format message
             if message_text.startswith('/listopenroutermodels'):
                 reply_text = list_openrouter_models_as_message()
                 send_message(chat_id, reply_text)
@@ -479,18 +556,19 @@ def long_polling():
                 
             # Handle /openrouter command in long_polling
             if message_text.startswith("/openrouter"):
-                if len(message_text.split()) == 1:
+                command_args = message_text.split()
+                if len(command_args) == 1:
                     send_message(chat_id, "Please specify a model name after the command")
                     continue
-                model_substring = message_text.split()[1]
+                model_substring = command_args[1]
                 matching_models = get_matching_models(model_substring)
                 if len(matching_models) == 0:
                     send_message(chat_id, f"Model name {model_substring} not found in list of models")
                     continue
                 elif len(matching_models) == 1:
-                    session_data[chat_id]["model_version"] = "openrouter:" + matching_models[0]
-                    session_data[chat_id]["provider"] = "openrouter"
-                    send_message(chat_id, f"Model has been changed to {session_data[chat_id]['model_version']}")
+                    session["model_version"] = "openrouter:" + matching_models[0]
+                    session["provider"] = "openrouter"
+                    send_message(chat_id, f"Model has been changed to {session['model_version']}")
                     continue
                 else:
                     keyboard = [[{'text': model, 'callback_data': model}] for model in matching_models]
@@ -500,9 +578,9 @@ def long_polling():
                     continue
 
             # Check for other commands to switch models (excluding /openrouter here)
-            elif message_text.startswith("/gpt3") or message_text.startswith("/gpt4") or message_text.startswith("/claud3") or message_text.startswith("/llama3"):
+            elif message_text.startswith(MODEL_COMMAND_PREFIXES):
                 update_model_version(chat_id, message_text)
-                reply_text = f"Model has been changed to {session_data[chat_id]['model_version']}"
+                reply_text = f"Model has been changed to {session['model_version']}"
                 send_message(chat_id, reply_text)
                 continue
 
@@ -531,7 +609,7 @@ def long_polling():
                     
             if message_photo:
                 # Retrieve the file path of the image
-                file_info_response = requests.get(f"https://api.telegram.org/bot{BOT_KEY}/getFile?file_id={message_photo}")
+                file_info_response = http_session.get(f"https://api.telegram.org/bot{BOT_KEY}/getFile?file_id={message_photo}", timeout=HTTP_TIMEOUT)
                 file_info = file_info_response.json()
                 file_path = file_info['result']['file_path']
 
@@ -565,44 +643,46 @@ def long_polling():
             print(f"Error getting reply  on line {e.__traceback__.tb_lineno}: {e}")
             continue
 
-# Send a message to user
-def send_message(chat_id, text, reply_markup=None):
-    print(f'reply_markup {reply_markup} ')
-    MAX_LENGTH = 4096
-    def send_partial_message(chat_id, partial_text, reply_markup=None):        
-        message_data = {
-            "chat_id": chat_id,
-            "text": partial_text
-        }
-        if reply_markup:
-            message_data["reply_markup"] = reply_markup
+# Send one telegram sized piece of a message
+def send_partial_message(chat_id, partial_text, reply_markup=None):
+    message_data = {
+        "chat_id": chat_id,
+        "text": partial_text
+    }
+    if reply_markup:
+        message_data["reply_markup"] = reply_markup
+    if DEBUG:
         print(f'message_data {message_data} ')
-    #    print(message_data)
-        response = requests.post(f"https://api.telegram.org/bot{BOT_KEY}/sendMessage", json=message_data)
-        # For error cases, you might want to check if the request was successful:
-        if not response.ok:
-            # Print the reason for the error status code
-            print(f"Error Reason: {response.reason}")
+    response = http_session.post(f"https://api.telegram.org/bot{BOT_KEY}/sendMessage", json=message_data, timeout=HTTP_TIMEOUT)
+    # For error cases, you might want to check if the request was successful:
+    if not response.ok:
+        # Print the reason for the error status code
+        print(f"Error Reason: {response.reason}")
 
 
+# Send a message to user
+def send_message(chat_id, text, reply_markup=None):
+    if DEBUG:
+        print(f'reply_markup {reply_markup} ')
     while text:
         # If the text is shorter than the maximum, send it as is
-        if len(text) <= MAX_LENGTH:
+        if len(text) <= MAX_MESSAGE_LENGTH:
             send_partial_message(chat_id, text, reply_markup=reply_markup)
             break
         # If the text is too long, split it into smaller parts
         else:
-            # Find the last newline character within the first MAX_LENGTH characters
-            split_at = text.rfind('\n', 0, MAX_LENGTH)
-            # If no newline is found, split at MAX_LENGTH
+            # Find the last newline character within the first MAX_MESSAGE_LENGTH characters
+            split_at = text.rfind('\n', 0, MAX_MESSAGE_LENGTH)
+            # If no newline is found, split at MAX_MESSAGE_LENGTH
             if split_at == -1:
-                split_at = MAX_LENGTH
+                split_at = MAX_MESSAGE_LENGTH
             # Send the first part and shorten the remaining text
             send_partial_message(chat_id, text[:split_at], reply_markup=reply_markup)
             text = text[split_at:]
 
 
-long_polling()
+if __name__ == '__main__':
+    long_polling()
 
 
 ## Text for BotFather "commands", remove the "#" first